@@ -484,7 +484,7 @@ class BinSyncController:
                 pref_struct.last_change = None
 
             if pref_struct:
-                master_state.structs[struct_name] = pref_struct
+                master_state.set_struct(pref_struct, None, set_last_change=False)
 
             self.fill_struct(struct_name, state=master_state)
         self.client.commit_state(master_state, msg="Magic Sync Structs Merged")
@@ -514,7 +514,7 @@ class BinSyncController:
                 pref_func = Function.from_nonconflicting_merge(pref_func, user_func)
                 pref_func.last_change = None
 
-            master_state.functions[func_addr] = pref_func
+            master_state.set_function(pref_func)
             self.fill_function(func_addr, state=master_state)
 
         self.client.commit_state(master_state, msg="Magic Sync Funcs Merged")
@@ -542,7 +542,8 @@ class BinSyncController:
                 pref_gvar = GlobalVariable.from_nonconflicting_merge(pref_gvar, user_gvar)
                 pref_gvar.last_change = None
 
-            master_state.global_vars[gvar_addr] = pref_gvar
+            if pref_gvar:
+                master_state.set_global_var(pref_gvar, set_last_change=False)
             self.fill_global_var(gvar_addr, state=master_state)
 
         self.client.commit_state(master_state, msg="Magic Sync Global Vars Merged")
@@ -1,15 +1,21 @@
+import hashlib
 import logging
 import pathlib
 import os
 import re
+from io import BytesIO
 import subprocess
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import wraps
-from typing import Iterable, Optional
+from typing import Dict, Iterable, List, Optional
 
-import filelock
 import git
 import git.exc
+from git.index.typ import BaseIndexEntry
+from gitdb import IStream
+from gitdb.util import hex_to_bin
 
 from binsync.data import User
 from binsync.core.errors import ExternalUserCommitError, MetadataNotFoundError
@@ -17,10 +23,25 @@ from binsync.data.state import State, load_toml_from_file
 from binsync.core.scheduler import Scheduler, Job, SchedSpeed
 from binsync.core.cache import Cache
 
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
 
 l = logging.getLogger(__name__)
 BINSYNC_BRANCH_PREFIX = 'binsync'
 BINSYNC_ROOT_BRANCH = f'{BINSYNC_BRANCH_PREFIX}/__root__'
+BRANCH_CACHE_TTL = 1.0
+TREE_INDEX_CACHE_SIZE = 64
+
+_REMOTE_URL_RE = re.compile(r"/(.*)\.git")
+_SSH_AGENT_PID_RE = re.compile(r"Found ssh-agent at (\d+)")
+_SSH_AGENT_SOCK_RE = re.compile(r"Found ssh-agent socket at ([^\s]+)")
+_SSH_AGENT_PID_ENV_RE = re.compile(r"SSH_AGENT_PID=(\d+);")
+_SSH_AUTH_SOCK_ENV_RE = re.compile(r"SSH_AUTH_SOCK=(.*?);")
 
 
 class ConnectionWarnings:
@@ -35,7 +56,8 @@ def atomic_git_action(f):
     Cache. Generally, just never call functions with this decorator until the Client is done initing.
 
     This function will also attempt to check the cache for requested data on the same thread the original call
-    was made from. If not found, the atomic scheduling is done.
+    was made from. If not found, the atomic scheduling is done. Identical cacheable reads that are requested
+    while one is already scheduled wait on that one instead of scheduling their own Job.
 
     @param f:   A Client object function
     @return:
@@ -49,15 +71,46 @@ def atomic_git_action(f):
             if cache_item is not None:
                 return cache_item
 
-        # non cache available, queue it up!
-        priority = kwargs.get("priority", None) or SchedSpeed.SLOW
-        ret_val = self.scheduler.schedule_and_wait_job(
-            Job(f, self, *args, **kwargs),
-            priority=priority
-        )
+        # join an identical read that is already in flight
+        flight_key = self._inflight_key(f, args, kwargs)
+        flight = None
+        if flight_key is not None:
+            with self._inflight_lock:
+                flight = self._inflight.get(flight_key, None)
+                is_leader = flight is None
+                if is_leader:
+                    flight = self._inflight[flight_key] = Future()
+
+            if not is_leader:
+                ret_val = flight.result()
+                # prefer the cached copy so callers never share the same mutable result
+                cache_item = self._check_cache_(f, **kwargs)
+                return cache_item if cache_item is not None else ret_val
+
+        ret_val = None
+        error = None
+        try:
+            # non cache available, queue it up!
+            priority = kwargs.get("priority", None) or SchedSpeed.SLOW
+            ret_val = self.scheduler.schedule_and_wait_job(
+                Job(f, self, *args, **kwargs),
+                priority=priority
+            )
 
-        # set cache
-        self._set_cache(f, ret_val, **kwargs)
+            # set cache
+            self._set_cache(f, ret_val, **kwargs)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if flight is not None:
+                with self._inflight_lock:
+                    del self._inflight[flight_key]
+                # callers waiting on this one see the same outcome, errors included
+                if error is not None:
+                    flight.set_exception(error)
+                else:
+                    flight.set_result(ret_val)
 
         return ret_val
 
@@ -97,23 +150,62 @@ class Client:
         self.binary_hash = binary_hash
         self.remote = remote
         self.repo = None
-        self.repo_lock = None
+        self._lock_fd = None
+
+        self._stored_hash = None  # type: Optional[str]
+
+        # set when a commit failed after its changes were staged, so the next commit can't be skipped
+        self._uncommitted_index = False
+
+        # index entries staged by add_data, written together by flush_data
+        self._pending_entries: List[BaseIndexEntry] = []
+
+        # workers for the blob writes of a state dump
+        self._io_pool = ThreadPoolExecutor(max_workers=4)
+
+        # trees are immutable, so their `path -> blob sha` listings are kept by tree sha
+        self._tree_indexes = {}  # type: Dict[str, Dict[str, str]]
 
         # validate this username can exist
         if master_user.endswith('/') or '__root__' in master_user:
             raise Exception(f"Bad username: {master_user}")
+        self.user_branch_name = f"{BINSYNC_BRANCH_PREFIX}/{master_user}"
 
-        # ssh-agent info
-        self.ssh_agent_pid = ssh_agent_pid  # type: int
-        self.ssh_auth_sock = ssh_auth_sock  # type: str
+        # ssh-agent info, the env for remote operations is rebuilt only when these change
+        self._ssh_agent_pid = ssh_agent_pid  # type: int
+        self._ssh_auth_sock = ssh_auth_sock  # type: str
+        self._ssh_env = self._build_ssh_env()  # type: Dict[str, str]
         self.connection_warnings = []
 
         # job scheduler
         self.cache = Cache()
         self.scheduler = Scheduler()
 
+        # cache accessors by atomic action, and whether the action defaults `user` to the master user
+        self._cache_getters = {
+            Client.get_state.__qualname__: (self.cache.get_state, True),
+            Client.users.__qualname__: (self.cache.users, False),
+        }
+        self._cache_setters = {
+            Client.get_state.__qualname__: (self.cache.set_state, True),
+            Client.users.__qualname__: (self.cache.set_users, False),
+        }
+
+        # cacheable reads that are currently scheduled, see atomic_git_action
+        self._inflight = {}  # type: Dict[tuple, Future]
+        self._inflight_lock = threading.Lock()
+
+
+        # local branches by name, rebuilt when branches are created or the cache expires
+        self._branch_by_name = {}  # type: Dict[str, git.Head]
+        self._branch_cache_ts = None  # type: Optional[float]
+
+        # commits are immutable, so a user parsed from a commit never needs to be parsed again
+        self._user_by_commit = {}  # type: Dict[str, User]
+
         # create, init, and checkout Git repo
         self.repo = self._get_or_init_binsync_repo(remote_url, init_repo)
+        self._worktree_root = os.path.dirname(self.repo.git_dir)
         self.scheduler.start_worker_thread()
         self._get_or_init_user_branch()
 
@@ -128,8 +220,7 @@ class Client:
         self.active_remote = True
 
     def __del__(self):
-        if self.repo_lock is not None:
-            self.repo_lock.release()
+        self._release_repo_lock()
 
     #
     # Initializers
@@ -142,13 +233,10 @@ class Client:
 
         @return:
         """
-        try:
-            branch = next(o for o in self.repo.branches if o.name.endswith(self.user_branch_name))
-        except StopIteration:
+        branch = self._branches().get(self.user_branch_name, None)
+        if branch is None:
             branch = self.repo.create_head(self.user_branch_name, BINSYNC_ROOT_BRANCH)
-        else:
-            if branch.is_remote():
-                branch = self.repo.create_head(self.user_branch_name)
+            self._invalidate_branch_cache()
         branch.checkout()
 
     def _get_or_init_binsync_repo(self, remote_url, init_repo):
@@ -173,12 +261,12 @@ class Client:
         if remote_url:
             # given a remove URL and no local folder, make it based on the URL name
             if not self.repo_root:
-                self.repo_root = re.findall(r"/(.*)\.git", remote_url)[0]
+                self.repo_root = _REMOTE_URL_RE.findall(remote_url)[0]
 
             self.repo: git.Repo = self.clone(remote_url, no_head_check=init_repo)
 
             if init_repo:
-                if any(b.name == BINSYNC_ROOT_BRANCH for b in self.repo.branches):
+                if BINSYNC_ROOT_BRANCH in self._branch_names():
                     raise Exception("Can't init this remote repo since a BinSync root already exists")
 
                 self._setup_repo()
@@ -191,7 +279,7 @@ class Client:
 
                 if init_repo:
                     raise Exception("Could not initialize repository - it already exists!")
-                if not any(b.name == BINSYNC_ROOT_BRANCH for b in self.repo.branches):
+                if BINSYNC_ROOT_BRANCH not in self._branch_names():
                     raise Exception(f"This is not a BinSync repo - it must have a {BINSYNC_ROOT_BRANCH} branch.")
             except (git.NoSuchPathError, git.InvalidGitRepositoryError):
                 if init_repo:
@@ -201,22 +289,50 @@ class Client:
                 else:
                     raise Exception(f"Failed to connect or create a BinSync repo")
 
-        stored = self._get_stored_hash()
-        if stored != self.binary_hash:
+        # the root branch never changes after init, so its hash only needs to be read once
+        self._stored_hash = self._get_stored_hash()
+        if self._stored_hash != self.binary_hash:
             self.connection_warnings.append(ConnectionWarnings.HASH_MISMATCH)
 
         assert not self.repo.bare, "it should not be a bare repo"
 
-        self.repo_lock = filelock.FileLock(self.repo_root + "/.git/binsync.lock")
-        try:
-            self.repo_lock.acquire(timeout=0)
-        except filelock.Timeout as e:
-            raise Exception("Can only have one binsync client touching a local repository at once.\n"
-                            "If the previous client crashed, you need to delete " + self.repo_root +
-                            "/.git/binsync.lock") from e
+        self._acquire_repo_lock()
 
         return self.repo
 
+    def _acquire_repo_lock(self):
+        """
+        Takes an exclusive, non-blocking OS lock on .git/binsync.lock so only one client can touch the
+        local repo at once. The OS drops the lock if the client dies, so a crash never leaves it stale.
+
+        @return:
+        """
+        lock_fd = open(os.path.join(self.repo_root, ".git", "binsync.lock"), "w")
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_fd.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(lock_fd.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError as e:
+            lock_fd.close()
+            raise Exception("Can only have one binsync client touching a local repository at once.") from e
+
+        self._lock_fd = lock_fd
+
+    def _release_repo_lock(self):
+        lock_fd = getattr(self, "_lock_fd", None)
+        if lock_fd is None:
+            return
+
+        self._lock_fd = None
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_fd.fileno(), fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(lock_fd.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            lock_fd.close()
+
     def _setup_repo(self):
         """
         For use in initializing folder that is not yet a Git repo.
@@ -230,6 +346,7 @@ class Client:
         self.repo.index.add([".gitignore", "binary_hash"])
         self.repo.index.commit("Root commit")
         self.repo.create_head(BINSYNC_ROOT_BRANCH)
+        self._invalidate_branch_cache()
 
     #
     # Public Properties
@@ -248,8 +365,22 @@ class Client:
         return self._last_commit_ts
 
     @property
-    def user_branch_name(self):
-        return f"{BINSYNC_BRANCH_PREFIX}/{self.master_user}"
+    def ssh_agent_pid(self):
+        return self._ssh_agent_pid
+
+    @ssh_agent_pid.setter
+    def ssh_agent_pid(self, pid):
+        self._ssh_agent_pid = pid
+        self._ssh_env = self._build_ssh_env()
+
+    @property
+    def ssh_auth_sock(self):
+        return self._ssh_auth_sock
+
+    @ssh_auth_sock.setter
+    def ssh_auth_sock(self, sock):
+        self._ssh_auth_sock = sock
+        self._ssh_env = self._build_ssh_env()
 
     #
     # Atomic Public API
@@ -260,17 +391,20 @@ class Client:
         if self.master_user != state.user:
             raise ExternalUserCommitError(f"User {self.master_user} is not allowed to commit to user {state.user}")
 
+        # nothing changed since the last commit or parse
+        if not state.dirty:
+            return
+
         self._checkout_to_master_user()
-        master_user_branch = next(o for o in self.repo.branches if o.name == self.user_branch_name)
+        master_user_branch = self._branches()[self.user_branch_name]
         index = self.repo.index
+        # read the entries now, the lazy read is not safe while dump workers compare against them
+        _ = index.entries
 
-        # dump the state
-        state.dump(index)
-
-        # commit changes
-        self.repo.index.add([os.path.join(state.user, "*")])
-
-        if not self.repo.index.diff("HEAD"):
+        # dump the state, only commit if any file differs from the index, or the index still holds
+        # changes from an earlier commit that failed
+        if not state.dump(index, executor=self._io_pool) and not self._uncommitted_index:
+            state._dirty = False
             return
 
         # commit if there is any difference
@@ -278,8 +412,10 @@ class Client:
             commit = index.commit(msg)
         except Exception as e:
             l.warning(f"Internal Git Commit Error: {e}")
+            self._uncommitted_index = True
             return
 
+        self._uncommitted_index = False
         self._last_commit_ts = time.time()
         master_user_branch.commit = commit
         state._dirty = False
@@ -288,10 +424,14 @@ class Client:
     def users(self, priority=None, no_cache=False) -> Iterable[User]:
         repo = self.repo
         users = list()
-        for ref in self._get_best_refs(repo).values():
+        for commit_sha in self._get_best_refs(repo).values():
             try:
-                metadata = load_toml_from_file(ref.commit.tree, "metadata.toml", client=self)
-                user = User.from_metadata(metadata)
+                user = self._user_by_commit.get(commit_sha, None)
+                if user is None:
+                    metadata = load_toml_from_file(repo.commit(commit_sha).tree, "metadata.toml", client=self)
+                    user = User.from_metadata(metadata)
+                    self._user_by_commit[commit_sha] = user
+
                 users.append(user)
             except Exception as e:
                 l.debug(f"Unable to load user {e}")
@@ -326,32 +466,19 @@ class Client:
         :return:    None
         """
         self.last_pull_attempt_ts = time.time()
-        try:
-            env = self.ssh_agent_env()
-        except Exception:
-            return
-
-        with self.repo.git.custom_environment(**env):
+        self._checkout_to_master_user()
+        with self.repo.git.custom_environment(**self._ssh_env):
             # dangerous remote operations happen here
             try:
-                self._localize_remote_branches()
-                self.repo.git.checkout(BINSYNC_ROOT_BRANCH)
-                self.repo.git.fetch("--all")
-                self.repo.git.pull("--all")
+                self._fetch_branches()
                 self._last_pull_ts = time.time()
             except Exception as e:
                 l.debug(f"Pull exception {e}")
 
-        # preform a merge on each branch
-        for branch in self.repo.branches:
-            if "HEAD" in branch.name:
-                continue
-
-            self.repo.git.checkout(branch)
-            try:
-                self.repo.git.merge()
-            except Exception as e:
-                l.debug(f"Failed to merge on {branch} with {e}")
+        # advance the checked-out branch and any branch the fetch could not fast-forward
+        self._fast_forward_branches()
+        self._checkout_to_master_user()
+        self._invalidate_branch_cache()
 
         self._update_cache()
 
@@ -365,8 +492,7 @@ class Client:
         self.last_push_attempt_ts = time.time()
         self._checkout_to_master_user()
         try:
-            env = self.ssh_agent_env()
-            with self.repo.git.custom_environment(**env):
+            with self.repo.git.custom_environment(**self._ssh_env):
                 self.repo.remotes[self.remote].push(BINSYNC_ROOT_BRANCH)
                 self.repo.remotes[self.remote].push(self.user_branch_name)
             self._last_push_ts = time.time()
@@ -416,12 +542,11 @@ class Client:
     def _localize_remote_branches(self):
         """
         Looks up all the remote refrences on the server and attempts to make them a tracked local
-        branch.
+        branch. All new branches are created by a single `git update-ref --stdin` transaction and
+        their upstreams are set in one config write, rather than a `checkout --track` per branch.
 
         @return:
         """
-
-
         # get all remote branches
         try:
             remote_branches = self.repo.remote().refs
@@ -429,31 +554,160 @@ class Client:
             return
 
         # track any remote we are not already tracking
-        local_branches = set(b.name for b in self.repo.branches)
+        local_branches = self._branch_names()
+        remote_re = re.compile(rf"{re.escape(self.remote)}/(.*)")
+        new_branches = {}
         for branch in remote_branches:
             # exclude head commit
             if "HEAD" in branch.name:
                 continue
 
             # attempt to localize the remote name
-            try:
-                local_name = re.findall(f"({self.remote}/)(.*)", branch.name)[0][1]
-            except IndexError:
-                print("INDEX ERROR")
+            m = remote_re.match(branch.name)
+            if m is None:
                 continue
+            local_name = m.group(1)
 
             # never try to track things already tracked
             if local_name in local_branches:
                 continue
 
+            new_branches[local_name] = branch.commit.hexsha
+
+        if not new_branches:
+            return
+
+        ref_updates = "".join(
+            f"create refs/heads/{local_name}\0{sha}\0" for local_name, sha in new_branches.items()
+        )
+        try:
+            proc = self.repo.git.update_ref("--stdin", "-z", as_process=True, istream=subprocess.PIPE)
+            proc.proc.stdin.write(ref_updates.encode())
+            proc.proc.stdin.close()
+            proc.wait()
+        except git.GitCommandError as e:
+            l.debug(f"Failed to localize remote branches: {e}")
+            return
+
+        with self.repo.config_writer() as config:
+            for local_name in new_branches:
+                config.set_value(f'branch "{local_name}"', "remote", self.remote)
+                config.set_value(f'branch "{local_name}"', "merge", f"refs/heads/{local_name}")
+
+        self._invalidate_branch_cache()
+
+    def _fetch_branches(self):
+        """
+        Fetches the remote and fast-forwards every local BinSync branch except the checked-out one in
+        that same invocation, since fetch can move refs directly. The checked-out branch is excluded
+        so the index never falls behind it.
+
+        Updates that are not fast-forwards are rejected by fetch and, like the checked-out branch,
+        are left to _fast_forward_branches. Branches of users that are new to the remote are created
+        by the same refspec, so pull does not need to localize them.
+
+        A negative refspec excludes its source from every refspec of the command, so the remote-tracking
+        ref of the checked-out branch is updated by a second fetch of that branch alone. This trades the
+        single fetch invocation for never falling behind commits pushed from another clone of the same
+        user, which would otherwise make every later push fail.
+
+        @return:
+        """
+        refspecs = [
+            f"refs/heads/{BINSYNC_BRANCH_PREFIX}/*:refs/heads/{BINSYNC_BRANCH_PREFIX}/*",
+            f"+refs/heads/{BINSYNC_BRANCH_PREFIX}/*:refs/remotes/{self.remote}/{BINSYNC_BRANCH_PREFIX}/*",
+            f"^refs/heads/{self.user_branch_name}",
+        ]
+        try:
+            self.repo.git.fetch(self.remote, *refspecs)
+            self.repo.git.fetch(
+                self.remote,
+                f"+refs/heads/{self.user_branch_name}:refs/remotes/{self.remote}/{self.user_branch_name}"
+            )
+        except git.GitCommandError as e:
+            # some refs were rejected (or git is too old for negative refspecs), make sure the
+            # remote refs are current for the per-branch path
+            l.debug(f"Batched fetch failed, falling back to per-branch updates: {e}")
+            self.repo.git.fetch(self.remote)
+            # a plain fetch only updates remote-tracking refs, new users still need a local branch
+            self._localize_remote_branches()
+
+        self._invalidate_branch_cache()
+
+    def _fast_forward_branches(self):
+        """
+        Moves every local branch up to its remote counterpart. A fast-forward only needs the ref to
+        advance, so it is done with `update-ref` and the working tree is never touched. Only branches
+        that diverged from the remote fall back to a checkout and merge.
+
+        @return:
+        """
+        try:
+            remote_branches = self.repo.remote(self.remote).refs
+        except ValueError:
+            return
+
+        try:
+            current_branch = self.repo.active_branch.name
+        except TypeError:
+            # detached HEAD
+            current_branch = None
+
+        local_branches = self._branches()
+        for remote_branch in remote_branches:
+            if "HEAD" in remote_branch.name:
+                continue
+
+            local_name = remote_branch.remote_head
+            branch = local_branches.get(local_name, None)
+            if branch is None:
+                continue
+
+            local_sha = branch.commit.hexsha
+            remote_sha = remote_branch.commit.hexsha
+            if local_sha == remote_sha:
+                continue
+
             try:
-                self.repo.git.checkout('--track', branch.name)
+                if self.repo.is_ancestor(local_sha, remote_sha):
+                    if local_name == current_branch:
+                        self.repo.git.merge("--ff-only", remote_sha)
+                    else:
+                        self.repo.git.update_ref(f"refs/heads/{local_name}", remote_sha, local_sha)
+                elif not self.repo.is_ancestor(remote_sha, local_sha):
+                    # diverged, a real merge is needed, after which the original branch must be checked
+                    # out again for the remaining branches to be compared against it
+                    self.repo.git.checkout(local_name)
+                    try:
+                        self.repo.git.merge(remote_branch.name)
+                    finally:
+                        if current_branch is not None:
+                            self.repo.git.checkout(current_branch)
             except git.GitCommandError as e:
-                continue
+                l.debug(f"Failed to merge on {local_name} with {e}")
+
+    def _branches(self) -> Dict[str, git.Head]:
+        """
+        Gets the local branches of the repo by name. GitPython re-reads the refs from disk on every
+        access to `repo.branches`, so the mapping is cached until a branch is created or it is older
+        than BRANCH_CACHE_TTL seconds.
 
+        @return:
+        """
+        now = time.time()
+        if self._branch_cache_ts is None or now - self._branch_cache_ts > BRANCH_CACHE_TTL:
+            self._branch_by_name = {b.name: b for b in self.repo.branches}
+            self._branch_cache_ts = now
 
+        return self._branch_by_name
 
-    def ssh_agent_env(self):
+    def _branch_names(self):
+        return self._branches().keys()
+
+    def _invalidate_branch_cache(self):
+        self._branch_cache_ts = None
+
+    def _build_ssh_env(self):
         if self.ssh_agent_pid is not None and self.ssh_auth_sock is not None:
             env = {
                 'SSH_AGENT_PID': str(self.ssh_agent_pid),
@@ -471,8 +725,7 @@ class Client:
         :return:                None
         """
 
-        env = self.ssh_agent_env()
-        repo = git.Repo.clone_from(remote_url, self.repo_root, env=env)
+        repo = git.Repo.clone_from(remote_url, self.repo_root, env=self._ssh_env)
 
         if no_head_check:
             return repo
@@ -510,164 +763,254 @@ class Client:
             ))
 
         # parse output
-        m = re.search(r"Found ssh-agent at (\d+)", stdout)
+        m = _SSH_AGENT_PID_RE.search(stdout)
         if m is None:
-            print("Failed to find 'Found ssh-agent at'")
-            m = re.search(r"SSH_AGENT_PID=(\d+);", stdout)
+            l.debug("Failed to find 'Found ssh-agent at'")
+            m = _SSH_AGENT_PID_ENV_RE.search(stdout)
             if m is None:
-                print("Failed to find SSH_AGENT_PID")
+                l.debug("Failed to find SSH_AGENT_PID")
                 return None, None
-            print("Found SSH_AGENT_PID")
+            l.debug("Found SSH_AGENT_PID")
             ssh_agent_pid = int(m.group(1))
-            m = re.search("SSH_AUTH_SOCK=(.*?);", stdout)
+            m = _SSH_AUTH_SOCK_ENV_RE.search(stdout)
             if m is None:
-                print("Failed to find SSH_AUTH_SOCK")
+                l.debug("Failed to find SSH_AUTH_SOCK")
                 return None, None
-            print("Found SSH_AGENT_SOCK")
+            l.debug("Found SSH_AGENT_SOCK")
             ssh_agent_sock = m.group(1)
         else :
-            print("Found ssh-agent at")
+            l.debug("Found ssh-agent at")
             ssh_agent_pid = int(m.group(1))
-            m = re.search(r"Found ssh-agent socket at ([^\s]+)", stdout)
+            m = _SSH_AGENT_SOCK_RE.search(stdout)
             if m is None:
-                print("Failed to find 'Found ssh-agent socket at'")
+                l.debug("Failed to find 'Found ssh-agent socket at'")
                 return None, None
-            print("Found ssh-agent socket at")
+            l.debug("Found ssh-agent socket at")
             ssh_agent_sock = m.group(1)
 
         return ssh_agent_pid, ssh_agent_sock
 
     def close(self):
+        self._io_pool.shutdown()
+        self._release_repo_lock()
         self.repo.close()
         del self.repo
 
-    def _get_best_refs(self, repo):
+    def _get_best_refs(self, repo) -> Dict[str, str]:
+        """
+        Finds the head commit of every BinSync branch, preferring the remote copy of a branch over the
+        local one. All refs are listed by one `git for-each-ref` call, so no GitPython ref objects are built.
+
+        @param repo:
+        @return:        A dict of branch (user) name to commit hexsha
+        """
+        remote_prefix = f"refs/remotes/{self.remote}/"
+        out = repo.git.for_each_ref(
+            "--format=%(refname) %(objectname)",
+            f"refs/heads/{BINSYNC_BRANCH_PREFIX}",
+            f"{remote_prefix}{BINSYNC_BRANCH_PREFIX}",
+        )
+
         candidates = {}
-        for ref in repo.refs:  # type: git.Reference
-            if f'{BINSYNC_BRANCH_PREFIX}/' not in ref.name:
+        for line in out.splitlines():
+            ref_name, commit_sha = line.split(" ")
+            branch_name = ref_name.rsplit("/", 1)[-1]
+            # if the candidate exists, and the new one is not remote, don't replace it
+            if branch_name in candidates and not ref_name.startswith(remote_prefix):
                 continue
 
-            branch_name = ref.name.split("/")[-1]
-            if branch_name in candidates:
-                # if the candidate exists, and the new one is not remote, don't replace it
-                if not ref.is_remote() or ref.remote_name != self.remote:
-                    continue
-
-            candidates[branch_name] = ref
+            candidates[branch_name] = commit_sha
         return candidates
 
     def _get_stored_hash(self):
-        branch = [ref for ref in self.repo.refs if ref.name.endswith(BINSYNC_ROOT_BRANCH)][0]
-        return branch.commit.tree["binary_hash"].data_stream.read().decode().strip("\n")
+        if self._stored_hash is not None:
+            return self._stored_hash
+
+        # read through GitPython's persistent `git cat-file --batch` process
+        return self.repo.git.get_object_data(f"refs/heads/{BINSYNC_ROOT_BRANCH}:binary_hash")[3].decode().strip("\n")
 
     def list_files_in_tree(self, base_tree: git.Tree):
         """
         Lists all the files in a repo at a given tree
 
-        :param commit: A gitpython Tree object
+        :param base_tree: A gitpython Tree object
         """
-        file_list = []
-        stack = [base_tree]
-        while len(stack) > 0:
-            tree = stack.pop()
-            # enumerate blobs (files) at this level
-            for b in tree.blobs:
-                file_list.append(b.path)
-            for subtree in tree.trees:
-                stack.append(subtree)
+        return list(self._tree_index(base_tree))
 
-        return file_list
+    def _tree_index(self, tree: git.Tree) -> Dict[str, str]:
+        """
+        Maps every file path in a tree to its blob sha. The whole tree is listed by a single
+        `git ls-tree -r` instead of walking (and linearly searching) each subtree object from Python.
+        Listings are cached by tree sha since trees never change.
+
+        :param tree: A gitpython Tree object
+        """
+        index = self._tree_indexes.get(tree.hexsha, None)
+        if index is not None:
+            return index
+
+        index = {}
+        out = self.repo.git.ls_tree("-r", "-z", tree.hexsha)
+        for entry in out.split("\0"):
+            if not entry:
+                continue
+
+            # each entry is `<mode> <type> <sha>\t<path>`
+            info, path = entry.split("\t", 1)
+            _, obj_type, sha = info.split(" ")
+            if obj_type == "blob":
+                index[path] = sha
+
+        if len(self._tree_indexes) >= TREE_INDEX_CACHE_SIZE:
+            # evict the oldest listing
+            self._tree_indexes.pop(next(iter(self._tree_indexes)), None)
+        self._tree_indexes[tree.hexsha] = index
+
+        return index
 
     def add_data(self, index: git.IndexFile, path: str, data: bytes):
         """
-        Adds physical files to the database.
+        Adds a file to the database. The data is written straight into the object database, so git
+        never re-hashes the working tree copy, which is only overwritten to stay in sync with the index.
+        The index entry is only queued; call flush_data once all files are added to write the index a
+        single time.
 
-        WARNING: this function touches physical files in the Git Repo which can result in a race
-        condition to modify a file while it is also being pushed. ONLY CALL THIS FUNCTION INSIDE
-        A COMMIT_LOCK.
+        WARNING: this function modifies the index and the working tree of the Git Repo which can result
+        in a race condition to modify a file while it is also being pushed. ONLY CALL THIS FUNCTION
+        INSIDE A COMMIT_LOCK.
 
         @param index:
         @param path:
         @param data:
-        @return:
+        @return:        True if the data differs from what the index already had for the path
         """
-        fullpath = os.path.join(os.path.dirname(index.repo.git_dir), path)
-        pathlib.Path(fullpath).parent.mkdir(parents=True, exist_ok=True)
-        with open(fullpath, 'wb') as fp:
+        path = pathlib.Path(path).as_posix()
+
+        # skip data that is already staged
+        binsha = hashlib.sha1(b"blob %d\0" % len(data) + data).digest()
+        entry = index.entries.get((path, 0), None)
+        if entry is not None and entry.binsha == binsha:
+            return False
+
+        try:
+            istream = index.repo.odb.store(IStream(git.Blob.type, len(data), BytesIO(data)))
+        except FileExistsError:
+            # on Windows the object file can't be renamed into place when a concurrent dump worker
+            # stored the same object first
+            istream = index.repo.odb.store(IStream(git.Blob.type, len(data), BytesIO(data)))
+        self._pending_entries.append(BaseIndexEntry((git.Blob.file_mode, istream.binsha, 0, path)))
+
+        # keep the working tree in sync, a stale copy would also block later checkouts
+        fullpath = os.path.join(self._worktree_root, path)
+        try:
+            fp = open(fullpath, 'wb')
+        except FileNotFoundError:
+            # only the first file of a directory pays for creating it
+            pathlib.Path(fullpath).parent.mkdir(parents=True, exist_ok=True)
+            fp = open(fullpath, 'wb')
+        with fp:
             fp.write(data)
-        index.add([fullpath])
+
+        return True
+
+    def flush_data(self, index: git.IndexFile):
+        """
+        Stages every entry queued by add_data with a single index write.
+
+        @param index:
+        @return:
+        """
+        if not self._pending_entries:
+            return
+
+        entries, self._pending_entries = self._pending_entries, []
+        index.add(entries)
 
     def remove_data(self, index: git.IndexFile, path: str):
-        fullpath = os.path.join(os.path.dirname(index.repo.git_dir), path)
-        pathlib.Path(fullpath).parent.mkdir(parents=True, exist_ok=True)
+        fullpath = os.path.join(self._worktree_root, path)
         index.remove([fullpath], working_tree=True)
 
     def load_file_from_tree(self, tree: git.Tree, filename):
-        return tree[filename].data_stream.read().decode()
+        return self.repo.odb.stream(hex_to_bin(self._tree_index(tree)[filename])).read().decode()
 
     def _get_tree(self, user, repo: git.Repo):
-        options = [ref for ref in repo.refs if ref.name.endswith(f"{BINSYNC_BRANCH_PREFIX}/{user}")]
-        if not options:
+        # find the latest commit for the specified user, local or on any remote, in one `git for-each-ref` call
+        branch = f"{BINSYNC_BRANCH_PREFIX}/{user}"
+        commit_sha = repo.git.for_each_ref(
+            "--sort=-authordate",
+            "--count=1",
+            "--format=%(objectname)",
+            f"refs/heads/{branch}",
+            f"refs/remotes/*/{branch}",
+        ).strip()
+        if not commit_sha:
             raise ValueError(f'No such user "{user}" found in repository')
 
-        # find the latest commit for the specified user!
-        best = max(options, key=lambda ref: ref.commit.authored_date)
-        bct = best.commit.tree
-
-        return bct
+        return repo.commit(commit_sha).tree
 
     #
     # Caching Functions
     #
 
     def _get_commits_for_users(self, repo: git.Repo):
-        ref_dict = self._get_best_refs(repo)
+        commit_dict = self._get_best_refs(repo)
 
         # ignore the _root_ branch
-        if BINSYNC_ROOT_BRANCH in ref_dict:
-            del ref_dict[BINSYNC_ROOT_BRANCH]
+        commit_dict.pop(BINSYNC_ROOT_BRANCH.rsplit("/", 1)[-1], None)
 
-        commit_dict = {
-            branch_name: ref.commit.hexsha for branch_name, ref in ref_dict.items()
-        }
         return commit_dict
 
+    def _inflight_key(self, f, args, kwargs):
+        """
+        Builds the key used to coalesce identical concurrent calls of a read-only atomic action.
+        Only the cacheable reads are coalesced; writers and calls with unhashable arguments get None.
+        """
+        if f.__qualname__ not in self._cache_getters:
+            return None
+
+        try:
+            key = (f.__qualname__, args, frozenset(kwargs.items()))
+            hash(key)
+        except TypeError:
+            return None
+
+        return key
+
     def _check_cache_(self, f, **kwargs):
-        if f.__qualname__ == self.get_state.__qualname__:
-            cache_func = self.cache.get_state
-            args = []
-            if kwargs.get("user", None) is None:
-                kwargs["user"] = self.master_user
-
-        elif f.__qualname__ == self.users.__qualname__:
-            cache_func = self.cache.users
-            args = []
-        else:
+        entry = self._cache_getters.get(f.__qualname__, None)
+        if entry is None:
             return None
 
-        item = cache_func(*args, **kwargs)
+        cache_func, default_user = entry
+        if default_user and kwargs.get("user", None) is None:
+            kwargs["user"] = self.master_user
+
+        item = cache_func(**kwargs)
 
         return item
 
     def _set_cache(self, f, ret_value, **kwargs):
-        if f.__qualname__ == self.get_state.__qualname__:
-            set_func = self.cache.set_state
-            args = []
-            if kwargs.get("user", None) is None:
-                kwargs["user"] = self.master_user
-        elif f.__qualname__ == self.users.__qualname__:
-            set_func = self.cache.set_users
-            args = []
-        else:
+        entry = self._cache_setters.get(f.__qualname__, None)
+        if entry is None:
             return None
 
-        set_func(ret_value, *args, **kwargs)
+        set_func, default_user = entry
+        if default_user and kwargs.get("user", None) is None:
+            kwargs["user"] = self.master_user
+
+        set_func(ret_value, **kwargs)
 
     def _update_cache(self):
         l.debug(f"Updating cache commits for State Cache...")
         cache_dict = self._get_commits_for_users(git.Repo(self.repo_root))
         self.cache.update_state_cache_commits(cache_dict)
 
+        # drop parsed users for commits that are no longer the head of any user branch
+        live_commits = set(cache_dict.values())
+        self._user_by_commit = {
+            sha: user for sha, user in self._user_by_commit.items() if sha in live_commits
+        }
+
         cache_keys = [key for key in cache_dict.keys()]
         l.debug(f"Updating branches on Users Cache...")
         branch_set = set(cache_keys)
@@ -9,6 +9,11 @@ import git
 import toml
 from sortedcontainers import SortedDict
 
+try:
+    import rtoml
+except ImportError:
+    rtoml = None
+
 from binsync.data import (
     Comment,
     Enum,
@@ -136,6 +141,14 @@ def list_files_in_dir(src: Union[pathlib.Path, git.Tree], dir_name, client=None)
     ]
 
 
+def _toml_loads(data: str) -> dict:
+    # prefer the Rust-backed parser when it is installed
+    if rtoml is not None:
+        return rtoml.loads(data)
+
+    return toml.loads(data)
+
+
 def load_toml_from_file(src: Union[pathlib.Path, git.Tree], filename, client=None):
     if client and isinstance(src, git.Tree):
         file_data = client.load_file_from_tree(src, filename)
@@ -146,7 +159,7 @@ def load_toml_from_file(src: Union[pathlib.Path, git.Tree], filename, client=Non
         with open(src.joinpath(filename), "r") as fp:
             file_data = fp.read()
 
-    return toml.loads(file_data)
+    return _toml_loads(file_data)
 
 
 #
@@ -210,11 +223,14 @@ class State:
     def dirty(self):
         return self._dirty
 
-    def _dump_data(self, dst: Union[pathlib.Path, git.IndexFile], filename, data):
+    def _dump_data(self, dst: Union[pathlib.Path, git.IndexFile], filename, data, executor=None):
+        # write on a worker instead, the Future resolves to the same bool
+        if executor is not None:
+            return executor.submit(self._dump_data, dst, filename, data)
+
         # dump using Git files
         if self.client and isinstance(dst, git.IndexFile):
-            self.client.add_data(dst, filename, data)
-            return
+            return self.client.add_data(dst, filename, data)
 
         # dump using filesystem
         if not dst:
@@ -225,7 +241,9 @@ class State:
         with open(out_path, "wb") as fp:
             fp.write(data)
 
-    def dump_metadata(self, dst: Union[pathlib.Path, git.IndexFile]):
+        return True
+
+    def dump_metadata(self, dst: Union[pathlib.Path, git.IndexFile], executor=None):
         d = {
             "user": self.user,
             "version": self.version,
@@ -233,36 +251,63 @@ class State:
             "last_push_artifact": self.last_push_artifact,
             "last_push_artifact_type": self.last_push_artifact_type,
         }
-        self._dump_data(dst, 'metadata.toml', toml.dumps(d).encode())
+        return self._dump_data(dst, 'metadata.toml', toml.dumps(d).encode(), executor=executor)
+
+    def dump(self, dst: Union[pathlib.Path, git.IndexFile], executor=None) -> bool:
+        """
+        Dumps every artifact of the state to dst.
 
-    def dump(self, dst: Union[pathlib.Path, git.IndexFile]):
+        @param dst:         A directory or the Git index to dump to
+        @param executor:    An optional concurrent.futures executor to overlap the file writes on
+        @return:            True if any dumped file differs from what dst already had
+        """
         if isinstance(dst, str):
             dst = pathlib.Path(dst)
 
         # dump metadata
-        self.dump_metadata(dst)
+        results = [self.dump_metadata(dst, executor=executor)]
 
         # dump functions, one file per function in ./functions/
         for addr, func in self.functions.items():
             path = pathlib.Path('functions').joinpath("%08x.toml" % addr)
-            self._dump_data(dst, path, func.dump().encode())
+            results.append(self._dump_data(dst, path, func.dump().encode(), executor=executor))
 
         # dump structs, one file per struct in ./structs/
         for s_name, struct in self.structs.items():
             path = pathlib.Path('structs').joinpath(f"{s_name}.toml")
-            self._dump_data(dst, path, struct.dump().encode())
+            results.append(self._dump_data(dst, path, struct.dump().encode(), executor=executor))
 
         # dump comments
-        self._dump_data(dst, 'comments.toml', toml.dumps(Comment.dump_many(self.comments)).encode())
+        results.append(self._dump_data(
+            dst, 'comments.toml', toml.dumps(Comment.dump_many(self.comments)).encode(), executor=executor
+        ))
 
         # dump patches
-        self._dump_data(dst, 'patches.toml', toml.dumps(Patch.dump_many(self.patches)).encode())
+        results.append(self._dump_data(
+            dst, 'patches.toml', toml.dumps(Patch.dump_many(self.patches)).encode(), executor=executor
+        ))
 
         # dump global vars
-        self._dump_data(dst, 'global_vars.toml', toml.dumps(GlobalVariable.dump_many(self.global_vars)).encode())
+        results.append(self._dump_data(
+            dst, 'global_vars.toml', toml.dumps(GlobalVariable.dump_many(self.global_vars)).encode(),
+            executor=executor
+        ))
 
         # dump enums
-        self._dump_data(dst, 'enums.toml', toml.dumps(Enum.dump_many(self.enums)).encode())
+        results.append(self._dump_data(
+            dst, 'enums.toml', toml.dumps(Enum.dump_many(self.enums)).encode(), executor=executor
+        ))
+
+        # wait for every write before staging
+        if executor is not None:
+            results = [future.result() for future in results]
+        changed = any(results)
+
+        # stage everything dumped to Git at once
+        if self.client and isinstance(dst, git.IndexFile):
+            self.client.flush_data(dst)
+
+        return changed
 
     @classmethod
     def parse(cls, src: Union[pathlib.Path, git.Tree], version=None, client=None):
@@ -353,6 +398,17 @@ class State:
     # Setters
     #
 
+    @dirty_checker
+    def set_function(self, func: Function):
+        if not func:
+            return False
+
+        if self.functions.get(func.addr, None) == func:
+            return False
+
+        self.functions[func.addr] = func
+        return True
+
     @dirty_checker
     @update_last_change
     def set_function_header(self, func_header: FunctionHeader, set_last_change=True):
@@ -450,6 +506,8 @@ class State:
         if struct.name is not None:
             self.structs[struct.name] = struct
 
+        return True
+
     @dirty_checker
     @update_last_change
     def set_global_var(self, gloabl_var: GlobalVariable, set_last_change=True):
@@ -72,9 +72,6 @@ class Loggers:
         self.load_all_loggers()
         self.profiling_enabled = False
 
-        # disable filelock info logs
-        logging.getLogger("filelock").setLevel(logging.WARNING)
-
         self.config_dict = None
         if default_config is not None:
             self.config_dict = default_config
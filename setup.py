@@ -16,8 +16,11 @@ setup(
         "sortedcontainers",
         "toml",
         "GitPython",
-        "filelock",
     ],
+    extras_require={
+        # faster TOML parsing, binsync falls back to toml without it
+        "fast": ["rtoml>=0.9"],
+    },
     description='Collaboration framework for binary analysis tasks.',
     long_description='Collaboration framework for binary analysis tasks.',
     long_description_content_type='text/markdown',
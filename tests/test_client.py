@@ -1,8 +1,13 @@
+import concurrent.futures
 import os
 import sys
 import tempfile
+import threading
 
 import unittest
+import unittest.mock
+
+import git
 
 import binsync
 
@@ -31,6 +36,9 @@ class TestClient(unittest.TestCase):
             client.commit_state(state)
             self.assertFalse(state.dirty)
 
+            # the working tree matches the commit
+            self.assertFalse(client.repo.is_dirty())
+
             state = client.get_state(user="user0")
             self.assertTrue(len(state.functions), 1)
             self.assertTrue(state.functions[0x400080].header, func_header)
@@ -38,6 +46,267 @@ class TestClient(unittest.TestCase):
             # git is still running at least on windows
             client.close()
 
+    def test_client_commit_unchanged(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = binsync.Client("user0", tmpdir, "fake_hash", init_repo=True)
+            state = client.get_state()
+            state.set_function_header(binsync.data.FunctionHeader("some_name", 0x400080))
+            client.commit_state(state)
+            head = client.repo.head.commit.hexsha
+
+            # a clean state is never dumped
+            client.commit_state(state)
+            self.assertEqual(client.repo.head.commit.hexsha, head)
+
+            # a dirty state that dumps identical files makes no commit
+            state._dirty = True
+            client.commit_state(state)
+            self.assertEqual(client.repo.head.commit.hexsha, head)
+            self.assertFalse(state.dirty)
+
+            client.close()
+
+    def test_client_commit_retry(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = binsync.Client("user0", tmpdir, "fake_hash", init_repo=True)
+            client.commit_state(client.get_state())
+            head = client.repo.head.commit.hexsha
+
+            # the first commit fails after the changes are already staged
+            state = client.get_state(no_cache=True)
+            state.set_function_header(binsync.data.FunctionHeader("some_name", 0x400080))
+            with unittest.mock.patch.object(git.IndexFile, "commit", side_effect=Exception("commit failed")):
+                client.commit_state(state)
+            self.assertEqual(client.repo.head.commit.hexsha, head)
+            self.assertTrue(state.dirty)
+
+            # retrying commits what is staged even though no file changed since
+            client.commit_state(state)
+            self.assertNotEqual(client.repo.head.commit.hexsha, head)
+            self.assertFalse(state.dirty)
+
+            client.close()
+
+    def _run_coalesced_get_state(self, client, schedule_and_wait_job):
+        """
+        Runs two identical get_state calls from separate threads. The first one is only scheduled once the
+        second one waits on it.
+        """
+        joined = threading.Event()
+        jobs = []
+        results = [None, None]
+
+        class _Flight(concurrent.futures.Future):
+            def result(self, timeout=None):
+                joined.set()
+                return super().result(timeout=timeout)
+
+        def _schedule(job, **kwargs):
+            jobs.append(job)
+            joined.wait(timeout=5)
+            return schedule_and_wait_job(job, **kwargs)
+
+        def _get_state(i):
+            try:
+                results[i] = client.get_state(no_cache=True)
+            except Exception as e:
+                results[i] = e
+
+        with unittest.mock.patch("binsync.core.client.Future", _Flight), \
+                unittest.mock.patch.object(client.scheduler, "schedule_and_wait_job", side_effect=_schedule):
+            threads = [threading.Thread(target=_get_state, args=(i,)) for i in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(timeout=10)
+
+        return jobs, results
+
+    def test_client_coalesce(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = binsync.Client("user0", tmpdir, "fake_hash", init_repo=True)
+            client.commit_state(client.get_state())
+
+            jobs, results = self._run_coalesced_get_state(client, client.scheduler.schedule_and_wait_job)
+            self.assertEqual(len(jobs), 1)
+            for state in results:
+                self.assertIsInstance(state, binsync.State)
+                self.assertEqual(state.user, "user0")
+
+            client.close()
+
+    def test_client_coalesce_error(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = binsync.Client("user0", tmpdir, "fake_hash", init_repo=True)
+
+            def _fail(job, **kwargs):
+                raise RuntimeError("scheduling failed")
+
+            jobs, results = self._run_coalesced_get_state(client, _fail)
+            self.assertEqual(len(jobs), 1)
+            for error in results:
+                self.assertIsInstance(error, RuntimeError)
+
+            client.close()
+
+    def test_client_users(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = binsync.Client("user0", tmpdir, "fake_hash", init_repo=True)
+            state = client.get_state()
+            client.commit_state(state)
+
+            users = client.users(no_cache=True)
+            self.assertEqual([u.name for u in users], ["user0"])
+
+            # unchanged branches reuse the already parsed user
+            same_users = client.users(no_cache=True)
+            self.assertIs(same_users[0], users[0])
+
+            client.close()
+
+    def test_client_pull(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            remote_path = os.path.join(tmpdir, "remote.git")
+            git.Repo.init(remote_path, bare=True)
+
+            client0 = binsync.Client("user0", os.path.join(tmpdir, "user0"), "fake_hash", init_repo=True,
+                                     remote_url=remote_path)
+            client0.commit_state(client0.get_state())
+            client0.push()
+
+            client1 = binsync.Client("user1", os.path.join(tmpdir, "user1"), "fake_hash", remote_url=remote_path)
+            client1.commit_state(client1.get_state())
+            client1.push()
+
+            # user1 is new to the remote, the pull creates its local branch
+            client0.pull()
+            self.assertEqual(
+                client0.repo.heads["binsync/user1"].commit.hexsha,
+                client1.repo.heads["binsync/user1"].commit.hexsha
+            )
+
+            # update user0 after user1 has seen it
+            client1.pull()
+            state = client0.get_state(no_cache=True)
+            func_header = binsync.data.FunctionHeader("some_name", 0x400080)
+            state.set_function_header(func_header)
+            client0.commit_state(state)
+            client0.push()
+
+            client1.pull()
+            user0_branch = client1.repo.heads["binsync/user0"]
+            self.assertEqual(user0_branch.commit.hexsha, client0.repo.heads["binsync/user0"].commit.hexsha)
+            self.assertEqual(client1.repo.active_branch.name, "binsync/user1")
+
+            state = client1.get_state(user="user0", no_cache=True)
+            self.assertEqual(state.functions[0x400080].header, func_header)
+
+            # user0 commits from a second clone, the first one has to pick up its own branch
+            client0_clone = binsync.Client("user0", os.path.join(tmpdir, "user0_clone"), "fake_hash",
+                                           remote_url=remote_path)
+            client0_clone.pull()
+            state = client0_clone.get_state(no_cache=True)
+            state.set_function_header(binsync.data.FunctionHeader("other_name", 0x400100))
+            client0_clone.commit_state(state)
+            client0_clone.push()
+
+            client0.pull()
+            clone_head = client0_clone.repo.heads["binsync/user0"].commit.hexsha
+            self.assertEqual(client0.repo.heads["binsync/user0"].commit.hexsha, clone_head)
+            self.assertEqual(client0.repo.remote("origin").refs["binsync/user0"].commit.hexsha, clone_head)
+
+            # the next push from the first clone is a fast-forward again
+            state = client0.get_state(no_cache=True)
+            state.set_function_header(binsync.data.FunctionHeader("third_name", 0x400180))
+            client0.commit_state(state)
+            client0.push()
+            remote_head = git.Repo(remote_path).heads["binsync/user0"].commit.hexsha
+            self.assertEqual(remote_head, client0.repo.heads["binsync/user0"].commit.hexsha)
+
+            client0.close()
+            client1.close()
+            client0_clone.close()
+
+    def test_client_open_new_remote_branch(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            remote_path = os.path.join(tmpdir, "remote.git")
+            git.Repo.init(remote_path, bare=True)
+
+            client0 = binsync.Client("user0", os.path.join(tmpdir, "user0"), "fake_hash", init_repo=True,
+                                     remote_url=remote_path)
+            client0.commit_state(client0.get_state())
+            client0.push()
+
+            client1 = binsync.Client("user1", os.path.join(tmpdir, "user1"), "fake_hash", remote_url=remote_path)
+            client1.commit_state(client1.get_state())
+            client1.push()
+            client1.close()
+
+            # user0 only learns about user1 through a plain fetch before opening its repo again
+            client0.repo.git.fetch("origin")
+            client0.close()
+            client0 = binsync.Client("user0", os.path.join(tmpdir, "user0"), "fake_hash")
+
+            user1_branch = client0.repo.heads["binsync/user1"]
+            self.assertEqual(user1_branch.commit, client0.repo.remote("origin").refs["binsync/user1"].commit)
+            self.assertEqual(user1_branch.tracking_branch().name, "origin/binsync/user1")
+            self.assertEqual(client0.repo.active_branch.name, "binsync/user0")
+
+            client0.close()
+
+    def test_client_pull_diverged(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            remote_path = os.path.join(tmpdir, "remote.git")
+            git.Repo.init(remote_path, bare=True)
+
+            client0 = binsync.Client("user0", os.path.join(tmpdir, "user0"), "fake_hash", init_repo=True,
+                                     remote_url=remote_path)
+            client0.commit_state(client0.get_state())
+            client0.push()
+
+            client1 = binsync.Client("user1", os.path.join(tmpdir, "user1"), "fake_hash", remote_url=remote_path)
+            client1.commit_state(client1.get_state())
+            client1.push()
+            client1.pull()
+
+            # user1 commits from a second clone
+            client1_clone = binsync.Client("user1", os.path.join(tmpdir, "user1_clone"), "fake_hash",
+                                           remote_url=remote_path)
+            client1_clone.pull()
+            state = client1_clone.get_state(no_cache=True)
+            state.set_function_header(binsync.data.FunctionHeader("some_name", 0x400080))
+            client1_clone.commit_state(state)
+            client1_clone.push()
+
+            # user0 advances on the remote while the local copy of user0 gets a commit of its own
+            state = client0.get_state(no_cache=True)
+            state.set_function_header(binsync.data.FunctionHeader("other_name", 0x400100))
+            client0.commit_state(state)
+            client0.push()
+            with client1.repo.config_writer() as config:
+                config.set_value("user", "name", "user1")
+                config.set_value("user", "email", "user1@binsync")
+            user0_branch = client1.repo.heads["binsync/user0"]
+            local_commit = client1.repo.git.commit_tree(
+                user0_branch.commit.tree.hexsha, "-p", user0_branch.commit.hexsha, "-m", "local change"
+            )
+            client1.repo.git.update_ref("refs/heads/binsync/user0", local_commit)
+
+            # the diverged user0 is merged first, user1 must still be fast-forwarded afterwards
+            client1.pull()
+            self.assertEqual(client1.repo.active_branch.name, "binsync/user1")
+            self.assertEqual(
+                client1.repo.heads["binsync/user1"].commit.hexsha,
+                client1_clone.repo.heads["binsync/user1"].commit.hexsha
+            )
+            merge_commit = client1.repo.heads["binsync/user0"].commit
+            self.assertIn(local_commit, [parent.hexsha for parent in merge_commit.parents])
+            self.assertIn(client0.repo.heads["binsync/user0"].commit, merge_commit.parents)
+
+            client0.close()
+            client1.close()
+            client1_clone.close()
+
 
 if __name__ == "__main__":
     unittest.main(argv=sys.argv)
@@ -24,6 +24,7 @@ class TestState(unittest.TestCase):
 
             # dump to the current repo, current branch
             state.dump(client.repo.index)
+            self.assertIn(("metadata.toml", 0), client.repo.index.entries)
             metadata_path = os.path.join(tmpdir, "metadata.toml")
             self.assertTrue(os.path.isfile(metadata_path))
 